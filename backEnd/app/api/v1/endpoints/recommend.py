@@ -3,7 +3,11 @@ Recommendation API Endpoint
 Provides product recommendations based on natural language queries.
 """
 import logging
-from fastapi import APIRouter, HTTPException
+from typing import Iterator
+
+import orjson
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import StreamingResponse
 
 from app.schemas.recommend_schema import (
     RecommendationRequest,
@@ -12,13 +16,32 @@ from app.schemas.recommend_schema import (
     parse_test_types,
     parse_duration
 )
+from app.services.embedding_service import get_query_cache_status
 from app.services.recommend_service import get_recommendations
+from app.services.vector_search_service import SearchResult
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def to_assessment(result: SearchResult) -> AssessmentRecommendation:
+    """
+    Convert a SearchResult into the API output format.
+    Values come from our own database and parsers, so validation is skipped.
+    """
+    product = result.product
+    return AssessmentRecommendation.model_construct(
+        url=product.url,
+        name=product.name,
+        adaptive_support="Yes" if product.adaptive_irt else "No",
+        description=product.description,
+        duration_minutes=parse_duration(product.assessment_length),
+        remote_support="Yes" if product.remote_testing else "No",
+        test_type=parse_test_types(product.test_type)
+    )
+
+
 @router.post(
     "/recommend",
     response_model=RecommendationResponse,
@@ -40,9 +63,16 @@ router = APIRouter()
         500: {"description": "Internal server error"}
     }
 )
-async def recommend(request: RecommendationRequest) -> RecommendationResponse:
+async def recommend(
+    request: RecommendationRequest,
+    http_response: Response
+) -> RecommendationResponse:
     """
     Generate assessment recommendations based on a natural language query.
+    
+    The X-Cache response header reports whether the query embedding was
+    served from a cache or a concurrent identical request (HIT) or
+    generated (MISS).
     """
     try:
         logger.info(f"Received recommendation request: query='{request.query[:50]}...', top_k={request.top_k}")
@@ -52,23 +82,12 @@ async def recommend(request: RecommendationRequest) -> RecommendationResponse:
             query=request.query,
             top_k=request.top_k
         )
+        http_response.headers["X-Cache"] = get_query_cache_status()
         
         # Convert SearchResult objects to the expected output format
-        recommended_assessments = []
-        for result in results:
-            product = result.product
-            assessment = AssessmentRecommendation(
-                url=product.url,
-                name=product.name,
-                adaptive_support="Yes" if product.adaptive_irt else "No",
-                description=product.description,
-                duration_minutes=parse_duration(product.assessment_length),
-                remote_support="Yes" if product.remote_testing else "No",
-                test_type=parse_test_types(product.test_type)
-            )
-            recommended_assessments.append(assessment)
+        recommended_assessments = [to_assessment(result) for result in results]
         
-        response = RecommendationResponse(
+        response = RecommendationResponse.model_construct(
             recommended_assessments=recommended_assessments
         )
         
@@ -86,3 +105,58 @@ async def recommend(request: RecommendationRequest) -> RecommendationResponse:
     except Exception as e:
         logger.exception(f"Unexpected error in recommendation endpoint: {e}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
+@router.post(
+    "/recommend/stream",
+    response_class=StreamingResponse,
+    summary="Stream Assessment Recommendations",
+    description="""
+    Same as `/recommend`, but streams the recommendations as newline-delimited
+    JSON (one assessment object per line, best match first) so clients can
+    render the first results before the whole response has been encoded.
+    """,
+    responses={
+        200: {
+            "description": "Stream of recommended assessments",
+            "content": {"application/x-ndjson": {}}
+        },
+        400: {"description": "Invalid request (e.g., empty query)"},
+        500: {"description": "Internal server error"}
+    }
+)
+async def recommend_stream(request: RecommendationRequest) -> StreamingResponse:
+    """
+    Stream assessment recommendations as NDJSON.
+    """
+    try:
+        logger.info(f"Received streaming recommendation request: query='{request.query[:50]}...', top_k={request.top_k}")
+        
+        results = await get_recommendations(
+            query=request.query,
+            top_k=request.top_k
+        )
+        cache_status = get_query_cache_status()
+    
+    except ValueError as e:
+        logger.warning(f"Invalid request: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    except RuntimeError as e:
+        logger.error(f"Recommendation service error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    except Exception as e:
+        logger.exception(f"Unexpected error in recommendation endpoint: {e}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+    
+    def generate() -> Iterator[bytes]:
+        for result in results:
+            yield orjson.dumps(to_assessment(result).model_dump()) + b"\n"
+    
+    logger.info(f"Streaming {len(results)} recommendations")
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"X-Cache": cache_status}
+    )
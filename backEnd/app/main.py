@@ -1,23 +1,39 @@
+import os
 import logging 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from contextlib import asynccontextmanager
 
 from app.schemas import ApiError
 from app.api.v1.endpoints import health, recommend 
+from app.services import embedding_service, recommend_service
 
 logging.basicConfig(
-    level=logging.DEBUG, 
+    level=os.getenv("LOG_LEVEL", "INFO").upper(), 
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 
 logger = logging.getLogger(__name__) 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the catalog cache so the first request doesn't pay for the load;
+    # requests reload it whenever the database changes
+    catalog = recommend_service.load_product_catalog()
+    logger.info(f"Loaded {len(catalog)} products into the catalog")
+    yield
+    # Release pooled connections to Azure OpenAI on shutdown
+    await embedding_service.close_client()
+
+
 app = FastAPI(
     title="SHL Assignment Backend API Server",
     description="BackEnd API server",
     version="0.0.1",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 @app.exception_handler(Exception)
@@ -29,9 +45,16 @@ async def global_exception_handler(request: Request, exc: Exception):
     return error.to_response()
 
 
+# Comma-separated list of allowed origins; defaults to allowing any origin
+CORS_ALLOW_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",")
+    if origin.strip()
+]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"]
+    allow_origins=CORS_ALLOW_ORIGINS
 )
 
 app.include_router(health.router, prefix="/api/v1", tags=["Health"])
@@ -1,6 +1,6 @@
 from typing import Optional, Any
 from pydantic import BaseModel
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
 class ApiError(BaseModel):
     status_code: int 
@@ -9,7 +9,7 @@ class ApiError(BaseModel):
     success: bool = False 
 
     def to_response(self):
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=self.status_code,
             content=self.model_dump()
         )
\ No newline at end of file
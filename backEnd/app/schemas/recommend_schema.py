@@ -19,6 +19,9 @@ TEST_TYPE_MAPPING = {
     "S": "Simulations"
 }
 
+# First number in an assessment length string, e.g. "25 minutes"
+DURATION_PATTERN = re.compile(r'\d+')
+
 
 def parse_test_types(test_type_str: Optional[str]) -> list[str]:
     """
@@ -28,16 +31,12 @@ def parse_test_types(test_type_str: Optional[str]) -> list[str]:
     if not test_type_str:
         return []
     
-    # Split by comma and strip whitespace
-    letters = [t.strip().upper() for t in test_type_str.split(",")]
-    
-    # Map to full names
-    full_names = []
-    for letter in letters:
-        if letter in TEST_TYPE_MAPPING:
-            full_names.append(TEST_TYPE_MAPPING[letter])
-    
-    return full_names
+    # Split by comma, normalize each letter and map known ones to full names
+    return [
+        TEST_TYPE_MAPPING[letter]
+        for letter in (t.strip().upper() for t in test_type_str.split(","))
+        if letter in TEST_TYPE_MAPPING
+    ]
 
 
 def parse_duration(assessment_length: Optional[str]) -> Optional[int]:
@@ -48,10 +47,13 @@ def parse_duration(assessment_length: Optional[str]) -> Optional[int]:
     if not assessment_length:
         return None
     
+    if not isinstance(assessment_length, str):
+        assessment_length = str(assessment_length)
+    
     # Try to extract numeric value
-    match = re.search(r'(\d+)', str(assessment_length))
+    match = DURATION_PATTERN.search(assessment_length)
     if match:
-        return int(match.group(1))
+        return int(match.group())
     
     return None
 
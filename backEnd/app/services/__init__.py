@@ -1,5 +1,6 @@
 from . import health_service
 from . import embedding_service
+from . import search_index
 from . import database_service
 from . import vector_search_service
 from . import recommend_service
\ No newline at end of file
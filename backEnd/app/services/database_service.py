@@ -2,17 +2,27 @@
 Database Service
 Handles all database operations for product retrieval.
 """
+import os
 import sqlite3
 import json
 import logging
-from typing import Optional
+import threading
+from typing import Any, Optional
 from dataclasses import dataclass
 
+import numpy as np
+
+from app.services import search_index
+
 logger = logging.getLogger(__name__)
 
 # Default database path (relative to project root)
 DEFAULT_DB_PATH = "shl_products.db"
 
+# Embeddings are stored as packed little-endian float32 BLOBs (4 bytes per
+# dimension), so databases are portable across platforms
+EMBEDDING_DTYPE = np.dtype("<f4")
+
 
 @dataclass
 class Product:
@@ -20,95 +30,340 @@ class Product:
     id: int
     name: str
     url: str
-    remote_testing: Optional[bool]
-    adaptive_irt: Optional[bool]
+    remote_testing: Optional[int]  # 0/1 flag as stored in SQLite
+    adaptive_irt: Optional[int]    # 0/1 flag as stored in SQLite
     test_type: Optional[str]
     description: Optional[str]
     job_levels: Optional[str]
     languages: Optional[str]
     assessment_length: Optional[str]
-    embedding: Optional[list[float]]
 
 
-def parse_embedding(embedding_str: str) -> Optional[list[float]]:
+# Stand-in for NULL in the catalog's int8 flag columns
+NULL_FLAG = -1
+
+# Product field name -> ProductCatalog column holding that field
+PRODUCT_COLUMNS = {
+    "id": "ids",
+    "name": "names",
+    "url": "urls",
+    "remote_testing": "remote_testing",
+    "adaptive_irt": "adaptive_irt",
+    "test_type": "test_types",
+    "description": "descriptions",
+    "job_levels": "job_levels",
+    "languages": "languages",
+    "assessment_length": "assessment_lengths",
+}
+
+
+def flag_value(flag: np.int8) -> Optional[int]:
     """
-    Parse embedding string from database into a list of floats.
+    Convert a catalog flag back to its database value (None for NULL).
     """
-    if not embedding_str:
-        return None
+    return None if flag == NULL_FLAG else int(flag)
+
+
+@dataclass
+class ProductCatalog:
+    """
+    Product metadata as row-aligned columns, together with the embeddings as
+    a single matrix. Row i of every column and of `embeddings` belongs to the
+    same product; embedding rows are L2-normalized.
+    
+    Searches scan only the embedding matrix and keyword index; Product objects
+    are built just for the rows that are returned.
+    """
+    ids: np.ndarray  # shape (N,), dtype int64
+    names: list[str]
+    urls: list[str]
+    remote_testing: np.ndarray  # shape (N,), dtype int8, NULL_FLAG for NULL
+    adaptive_irt: np.ndarray  # shape (N,), dtype int8, NULL_FLAG for NULL
+    test_types: list[Optional[str]]
+    descriptions: list[Optional[str]]
+    job_levels: list[Optional[str]]
+    languages: list[Optional[str]]
+    assessment_lengths: list[Optional[str]]
+    embeddings: np.ndarray  # shape (N, D), dtype float32
+    index: Optional[Any] = None  # FAISS index over `embeddings`, when available
+    quantized: Optional[np.ndarray] = None  # int8 copy of `embeddings`, when enabled
+    quantization_scales: Optional[np.ndarray] = None  # per-row scales for `quantized`
+    keyword_index: Optional[Any] = None  # built on first search by vector_search_service
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def column(self, field_name: str) -> list:
+        """
+        Return the column holding a Product field, e.g. "name" -> names.
+        """
+        return getattr(self, PRODUCT_COLUMNS[field_name])
+    
+    def get_product(self, row: int) -> Product:
+        """
+        Build the Product stored at a row.
+        """
+        return Product(
+            id=int(self.ids[row]),
+            name=self.names[row],
+            url=self.urls[row],
+            remote_testing=flag_value(self.remote_testing[row]),
+            adaptive_irt=flag_value(self.adaptive_irt[row]),
+            test_type=self.test_types[row],
+            description=self.descriptions[row],
+            job_levels=self.job_levels[row],
+            languages=self.languages[row],
+            assessment_length=self.assessment_lengths[row]
+        )
+
+
+# Loaded catalogs, keyed by database path, with the file mtime they were loaded at
+_catalog_cache: dict[str, tuple[Optional[float], ProductCatalog]] = {}
+
+# Per-thread open connections, keyed by database path, with the file inode
+# they were opened on
+_connections = threading.local()
+
+# Connection settings: WAL lets readers proceed while the data pipeline writes,
+# and memory-mapped I/O plus a 64 MiB page cache keep reads off the syscall path
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+
+def get_connection(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
+    """
+    Return this thread's connection to a database, opening it on first use.
+    
+    Connections stay open between queries so SQLite's page cache is reused.
+    A connection is reopened if the database file has been replaced.
+    """
+    connections = getattr(_connections, "by_path", None)
+    if connections is None:
+        connections = _connections.by_path = {}
     
     try:
-        embedding = json.loads(embedding_str)
-        if isinstance(embedding, list) and all(isinstance(x, (int, float)) for x in embedding):
-            return embedding
+        inode = os.stat(db_path).st_ino
+    except FileNotFoundError:
+        inode = None
+    
+    cached = connections.get(db_path)
+    if cached is not None:
+        if cached[1] == inode:
+            return cached[0]
+        cached[0].close()
+    
+    conn = sqlite3.connect(db_path)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    connections[db_path] = (conn, os.stat(db_path).st_ino)
+    return conn
+
+
+def parse_embedding(embedding_blob: bytes) -> Optional[np.ndarray]:
+    """
+    Interpret a packed float32 embedding BLOB as a vector (no copy).
+    """
+    if not embedding_blob:
         return None
-    except (json.JSONDecodeError, TypeError) as e:
-        logger.warning(f"Failed to parse embedding: {e}")
+    
+    if len(embedding_blob) % EMBEDDING_DTYPE.itemsize != 0:
+        logger.warning(f"Failed to parse embedding: invalid BLOB size {len(embedding_blob)}")
         return None
+    
+    return np.frombuffer(embedding_blob, dtype=EMBEDDING_DTYPE)
 
 
-def get_all_products(db_path: str = DEFAULT_DB_PATH) -> list[Product]:
+def migrate_embeddings_to_blob(conn: sqlite3.Connection) -> int:
+    """
+    Convert JSON-encoded embeddings into packed float32 BLOBs.
+    
+    Adds the `embedding_f32` column if needed and fills it for every row that
+    has a JSON `embedding` but no BLOB yet. Runs in a single transaction.
+    
+    Args:
+        conn: Open connection to the products database
+    
+    Returns:
+        Number of rows migrated
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(products)")
+    columns = {column[1] for column in cursor.fetchall()}
+    
+    if "embedding" not in columns:
+        return 0
+    
+    if "embedding_f32" not in columns:
+        logger.info("Adding 'embedding_f32' column to 'products' table...")
+        cursor.execute("ALTER TABLE products ADD COLUMN embedding_f32 BLOB")
+    
+    cursor.execute("""
+        SELECT id, embedding
+        FROM products
+        WHERE embedding_f32 IS NULL AND embedding IS NOT NULL AND embedding != ''
+    """)
+    
+    updates = []
+    for prod_id, embedding_str in cursor.fetchall():
+        try:
+            embedding = np.asarray(json.loads(embedding_str), dtype=EMBEDDING_DTYPE)
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            logger.warning(f"Skipping product {prod_id}: failed to parse embedding: {e}")
+            continue
+        if embedding.ndim != 1 or embedding.size == 0:
+            logger.warning(f"Skipping product {prod_id}: invalid embedding")
+            continue
+        updates.append((embedding.tobytes(), prod_id))
+    
+    if updates:
+        cursor.executemany("UPDATE products SET embedding_f32 = ? WHERE id = ?", updates)
+        logger.info(f"Migrated {len(updates)} embeddings to float32 BLOBs")
+    conn.commit()
+    
+    return len(updates)
+
+
+def load_catalog(db_path: str = DEFAULT_DB_PATH) -> ProductCatalog:
     """
     Retrieve all products with their embeddings from the database.
     
+    Embeddings are stacked into one (N, D) float32 matrix and L2-normalized
+    once, so cosine similarity against a normalized query is a single
+    matrix-vector product.
+    
     Args:
         db_path: Path to the SQLite database
     
     Returns:
-        List of Product objects with parsed embeddings
+        ProductCatalog with product columns and their row-aligned embedding matrix
     """
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
+        migrate_embeddings_to_blob(conn)
         cursor = conn.cursor()
         
         cursor.execute("""
             SELECT 
-                id, name, url, remote_testing, adaptive_irt, 
+                id, name, url,
+                IFNULL(CAST(remote_testing AS INTEGER), ?),
+                IFNULL(CAST(adaptive_irt AS INTEGER), ?),
                 test_type, description, job_levels, languages, 
-                assessment_length, embedding
+                assessment_length, embedding_f32
             FROM products
-            WHERE embedding IS NOT NULL AND embedding != ''
-        """)
+            WHERE embedding_f32 IS NOT NULL
+        """, (NULL_FLAG, NULL_FLAG))
         
         rows = cursor.fetchall()
-        conn.close()
         
-        products = []
+        metadata_rows = []
+        vectors = []
         for row in rows:
-            (
-                prod_id, name, url, remote_testing, adaptive_irt,
-                test_type, description, job_levels, languages,
-                assessment_length, embedding_str
-            ) = row
+            prod_id, embedding_blob = row[0], row[-1]
             
-            embedding = parse_embedding(embedding_str)
+            embedding = parse_embedding(embedding_blob)
             if embedding is None:
-                logger.debug(f"Skipping product {prod_id}: invalid embedding")
+                logger.debug("Skipping product %s: invalid embedding", prod_id)
+                continue
+            
+            if vectors and embedding.shape != vectors[0].shape:
+                logger.warning(
+                    f"Skipping product {prod_id}: embedding dimension {embedding.shape[0]} "
+                    f"does not match {vectors[0].shape[0]}"
+                )
                 continue
             
-            product = Product(
-                id=prod_id,
-                name=name,
-                url=url,
-                remote_testing=bool(remote_testing) if remote_testing is not None else None,
-                adaptive_irt=bool(adaptive_irt) if adaptive_irt is not None else None,
-                test_type=test_type,
-                description=description,
-                job_levels=job_levels,
-                languages=languages,
-                assessment_length=assessment_length,
-                embedding=embedding
-            )
-            products.append(product)
+            metadata_rows.append(row[:-1])
+            vectors.append(embedding)
+        
+        # Transpose the rows into one column per field
+        columns = [list(column) for column in zip(*metadata_rows)] or [[] for _ in PRODUCT_COLUMNS]
+        (
+            ids, names, urls, remote_testing, adaptive_irt,
+            test_types, descriptions, job_levels, languages,
+            assessment_lengths
+        ) = columns
         
-        logger.info(f"Retrieved {len(products)} products with valid embeddings from database")
-        return products
+        if vectors:
+            embeddings = np.vstack(vectors).astype(np.float32, copy=False)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            embeddings /= norms
+        else:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        
+        logger.info(f"Retrieved {len(ids)} products with valid embeddings from database")
+        return ProductCatalog(
+            ids=np.array(ids, dtype=np.int64),
+            names=names,
+            urls=urls,
+            remote_testing=np.array(remote_testing, dtype=np.int8),
+            adaptive_irt=np.array(adaptive_irt, dtype=np.int8),
+            test_types=test_types,
+            descriptions=descriptions,
+            job_levels=job_levels,
+            languages=languages,
+            assessment_lengths=assessment_lengths,
+            embeddings=embeddings
+        )
         
     except sqlite3.Error as e:
         logger.error(f"Database error while fetching products: {e}")
         raise RuntimeError(f"Database error: {e}")
 
 
+def get_database_mtime(db_path: str) -> Optional[float]:
+    """
+    Modification time of the database, or None if it does not exist.
+    
+    In WAL mode, writes land in the -wal file until they are checkpointed,
+    so its mtime is taken into account as well.
+    """
+    try:
+        mtime = os.stat(db_path).st_mtime
+    except FileNotFoundError:
+        return None
+    
+    try:
+        return max(mtime, os.stat(db_path + "-wal").st_mtime)
+    except FileNotFoundError:
+        return mtime
+
+
+def get_product_catalog(db_path: str = DEFAULT_DB_PATH) -> ProductCatalog:
+    """
+    Return the product catalog for a database.
+    
+    The catalog is loaded on first use and cached; it is reloaded only when
+    the database file has been modified since, so repeated calls cost a
+    single stat().
+    """
+    cached = _catalog_cache.get(db_path)
+    if cached is not None and cached[0] == get_database_mtime(db_path):
+        return cached[1]
+    
+    catalog = load_catalog(db_path)
+    # Record the mtime after loading, since loading may migrate the database
+    mtime = get_database_mtime(db_path)
+    
+    if search_index.should_index(len(catalog)):
+        # Uses the -wal aware mtime, as WAL commits leave the main file untouched
+        catalog.index = search_index.load_or_build_index(
+            catalog.embeddings,
+            index_path=os.path.splitext(db_path)[0] + ".faiss",
+            source_mtime=mtime
+        )
+    if search_index.should_quantize() and len(catalog) > 0:
+        catalog.quantized, catalog.quantization_scales = search_index.quantize_int8(
+            catalog.embeddings
+        )
+    
+    _catalog_cache[db_path] = (mtime, catalog)
+    return catalog
+
+
 def get_product_by_id(product_id: int, db_path: str = DEFAULT_DB_PATH) -> Optional[Product]:
     """
     Retrieve a single product by ID.
@@ -121,20 +376,19 @@ def get_product_by_id(product_id: int, db_path: str = DEFAULT_DB_PATH) -> Option
         Product object or None if not found
     """
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        cursor = get_connection(db_path).cursor()
         
         cursor.execute("""
             SELECT 
-                id, name, url, remote_testing, adaptive_irt, 
+                id, name, url,
+                CAST(remote_testing AS INTEGER), CAST(adaptive_irt AS INTEGER),
                 test_type, description, job_levels, languages, 
-                assessment_length, embedding
+                assessment_length
             FROM products
             WHERE id = ?
         """, (product_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if not row:
             return None
@@ -142,21 +396,20 @@ def get_product_by_id(product_id: int, db_path: str = DEFAULT_DB_PATH) -> Option
         (
             prod_id, name, url, remote_testing, adaptive_irt,
             test_type, description, job_levels, languages,
-            assessment_length, embedding_str
+            assessment_length
         ) = row
         
         return Product(
             id=prod_id,
             name=name,
             url=url,
-            remote_testing=bool(remote_testing) if remote_testing is not None else None,
-            adaptive_irt=bool(adaptive_irt) if adaptive_irt is not None else None,
+            remote_testing=remote_testing,
+            adaptive_irt=adaptive_irt,
             test_type=test_type,
             description=description,
             job_levels=job_levels,
             languages=languages,
-            assessment_length=assessment_length,
-            embedding=parse_embedding(embedding_str)
+            assessment_length=assessment_length
         )
         
     except sqlite3.Error as e:
@@ -3,9 +3,20 @@ Embedding Service
 Generates embeddings using Azure OpenAI with support for long texts via chunking.
 """
 import os
-import math
+import re
+import time
+import asyncio
+import sqlite3
+import hashlib
 import logging
-from openai import AsyncAzureOpenAI
+import threading
+from typing import Optional
+from contextvars import ContextVar
+from collections import OrderedDict
+
+import httpx
+import numpy as np
+from openai import AsyncAzureOpenAI, BadRequestError, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,18 +30,216 @@ MAX_CHARS = 25000  # ~6250 tokens, leaving buffer
 CHUNK_SIZE = 20000  # ~5000 tokens per chunk
 CHUNK_OVERLAP = 2000  # ~500 tokens overlap for context
 
-# Initialize Azure OpenAI client
+# Preferred chunk break points: sentence-ending punctuation followed by a space
+SENTENCE_BOUNDARIES = (". ", "! ", "? ", "\n")
+
+# Any run of whitespace (including newlines), collapsed during normalization
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Maximum number of query embeddings kept in the in-process LRU cache
+EMBEDDING_CACHE_SIZE = 4096
+
+# Bulk embedding: inputs per request and maximum concurrent requests
+EMBEDDING_BATCH_SIZE = 16
+MAX_CONCURRENT_BATCHES = 5
+
+# SHA-256 of normalized query text -> embedding, least recently used first
+_embedding_cache: OrderedDict[str, np.ndarray] = OrderedDict()
+
+# SHA-256 of normalized query text -> embedding request currently in flight
+_inflight_requests: dict[str, asyncio.Future] = {}
+
+# Where the current request's last query embedding came from: "HIT" for a
+# cache or a joined in-flight request, "MISS" for a new API call
+_query_cache_status: ContextVar[str] = ContextVar("query_cache_status", default="MISS")
+
+# Optional SQLite file that persists query embeddings across restarts
+# (unset disables the persistent cache)
+EMBEDDING_CACHE_DB_PATH = os.getenv("EMBEDDING_CACHE_DB_PATH")
+
+# Persisted embeddings older than this are ignored and pruned on write
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+_persistent_cache: Optional[sqlite3.Connection] = None
+
+# The persistent cache is used from worker threads; one at a time
+_persistent_cache_lock = threading.Lock()
+
+# Initialize Azure OpenAI client on a shared HTTP/2 connection pool so that
+# concurrent and chunked requests reuse warm keep-alive TLS connections
 try:
     client = AsyncAzureOpenAI(
         api_key=os.getenv("AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        http_client=DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            timeout=httpx.Timeout(30.0, connect=5.0)
+        )
     )
 except Exception as e:
     logger.error(f"Failed to initialize Azure OpenAI client: {e}")
     client = None
 
 
+async def close_client() -> None:
+    """
+    Close the Azure OpenAI client and its connection pool.
+    """
+    global _persistent_cache
+    
+    if client:
+        await client.close()
+    
+    with _persistent_cache_lock:
+        if _persistent_cache is not None:
+            _persistent_cache.close()
+            _persistent_cache = None
+
+
+def _get_persistent_cache() -> Optional[sqlite3.Connection]:
+    """
+    Open the persistent embedding cache on first use, if configured.
+    
+    Must be called with _persistent_cache_lock held.
+    """
+    global _persistent_cache
+    
+    if _persistent_cache is None and EMBEDDING_CACHE_DB_PATH:
+        try:
+            conn = sqlite3.connect(EMBEDDING_CACHE_DB_PATH, check_same_thread=False)
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS cache_embeddings (
+                        hash TEXT PRIMARY KEY,
+                        vec BLOB NOT NULL,
+                        ts INTEGER NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_embeddings_ts ON cache_embeddings(ts)")
+            _persistent_cache = conn
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent embedding cache unavailable: {e}")
+    
+    return _persistent_cache
+
+
+def _load_persistent_embedding(key: str) -> Optional[np.ndarray]:
+    """
+    Look up an unexpired embedding in the persistent cache.
+    
+    Blocking; call it from a worker thread.
+    """
+    with _persistent_cache_lock:
+        conn = _get_persistent_cache()
+        if conn is None:
+            return None
+        
+        try:
+            row = conn.execute(
+                "SELECT vec FROM cache_embeddings WHERE hash = ? AND ts >= ?",
+                (key, int(time.time()) - EMBEDDING_CACHE_TTL_SECONDS)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent embedding cache read failed: {e}")
+            return None
+    
+    if row is None:
+        return None
+    return np.frombuffer(row[0], dtype="<f4").astype(np.float32)
+
+
+def _store_persistent_embedding(key: str, embedding: np.ndarray) -> None:
+    """
+    Write an embedding to the persistent cache, pruning expired entries.
+    
+    Blocking; call it from a worker thread.
+    """
+    with _persistent_cache_lock:
+        conn = _get_persistent_cache()
+        if conn is None:
+            return
+        
+        now = int(time.time())
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_embeddings (hash, vec, ts) VALUES (?, ?, ?)",
+                    (key, embedding.astype("<f4").tobytes(), now)
+                )
+                conn.execute(
+                    "DELETE FROM cache_embeddings WHERE ts < ?",
+                    (now - EMBEDDING_CACHE_TTL_SECONDS,)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent embedding cache write failed: {e}")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapse newlines and repeated whitespace into single spaces.
+    """
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def _cache_key(text: str) -> str:
+    """
+    Cache key for an already-normalized query text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_query_cache_status() -> str:
+    """
+    Report whether the last get_query_embedding call in the current request
+    was served without a new API call ("HIT") or not ("MISS").
+    """
+    return _query_cache_status.get()
+
+
+def _cache_embedding(key: str, embedding: np.ndarray) -> None:
+    """
+    Store an embedding, evicting the least recently used entry when full.
+    
+    Cached arrays are shared between requests, so they are made read-only.
+    """
+    embedding.flags.writeable = False
+    _embedding_cache[key] = embedding
+    _embedding_cache.move_to_end(key)
+    if len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+        _embedding_cache.popitem(last=False)
+
+
+async def _lookup_embedding(key: str) -> Optional[np.ndarray]:
+    """
+    Find a cached embedding in memory, then in the persistent cache.
+    """
+    embedding = _embedding_cache.get(key)
+    if embedding is not None:
+        _embedding_cache.move_to_end(key)
+        logger.debug("Query embedding cache hit")
+        return embedding
+    
+    if not EMBEDDING_CACHE_DB_PATH:
+        return None
+    
+    embedding = await asyncio.to_thread(_load_persistent_embedding, key)
+    if embedding is not None:
+        logger.debug("Query embedding persistent cache hit")
+        _cache_embedding(key, embedding)
+    return embedding
+
+
+async def _store_embedding(key: str, embedding: np.ndarray) -> None:
+    """
+    Cache an embedding in memory and, if configured, in the persistent cache.
+    """
+    _cache_embedding(key, embedding)
+    if EMBEDDING_CACHE_DB_PATH:
+        await asyncio.to_thread(_store_persistent_embedding, key, embedding)
+
+
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[str]:
     """
     Split text into overlapping chunks for processing long documents.
@@ -58,13 +267,11 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVE
             chunks.append(text[start:])
             break
         
-        # Try to break at a sentence boundary (., !, ?)
-        # Look back from the end to find a good break point
-        break_point = end
-        for i in range(end, max(start + chunk_size // 2, start), -1):
-            if text[i] in '.!?\n':
-                break_point = i + 1
-                break
+        # Try to break at a sentence boundary in the second half of the chunk
+        # Search back from the end for the last punctuation + space (or newline)
+        window_start = start + chunk_size // 2 + 1
+        boundary = max(text.rfind(sep, window_start, end + 1) for sep in SENTENCE_BOUNDARIES)
+        break_point = boundary + 1 if boundary != -1 else end
         
         chunks.append(text[start:break_point])
         start = break_point - overlap  # Overlap for context
@@ -73,7 +280,17 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVE
     return chunks
 
 
-def average_embeddings(embeddings: list[list[float]]) -> list[float]:
+def normalize_embedding(embedding: np.ndarray) -> np.ndarray:
+    """
+    Scale an embedding to unit length in place (zero vectors are left as-is).
+    """
+    magnitude = np.linalg.norm(embedding)
+    if magnitude > 0:
+        embedding /= magnitude
+    return embedding
+
+
+def average_embeddings(embeddings: list[list[float]]) -> np.ndarray:
     """
     Average multiple embeddings into a single embedding.
     
@@ -81,32 +298,16 @@ def average_embeddings(embeddings: list[list[float]]) -> list[float]:
         embeddings: List of embedding vectors
     
     Returns:
-        Averaged embedding vector (normalized)
+        Averaged float32 embedding vector (normalized)
     """
     if not embeddings:
-        return []
+        return np.empty(0, dtype=np.float32)
     
     if len(embeddings) == 1:
-        return embeddings[0]
-    
-    # Calculate element-wise average
-    dimensions = len(embeddings[0])
-    averaged = [0.0] * dimensions
-    
-    for embedding in embeddings:
-        for i, val in enumerate(embedding):
-            averaged[i] += val
-    
-    # Divide by count
-    count = len(embeddings)
-    averaged = [val / count for val in averaged]
+        return np.asarray(embeddings[0], dtype=np.float32)
     
     # Normalize the averaged embedding (L2 normalization)
-    magnitude = math.sqrt(sum(x * x for x in averaged))
-    if magnitude > 0:
-        averaged = [x / magnitude for x in averaged]
-    
-    return averaged
+    return normalize_embedding(np.asarray(embeddings, dtype=np.float32).mean(axis=0))
 
 
 async def get_single_embedding(text: str, deployment_name: str) -> list[float]:
@@ -120,7 +321,80 @@ async def get_single_embedding(text: str, deployment_name: str) -> list[float]:
     return response.data[0].embedding
 
 
-async def get_query_embedding(text: str) -> list[float]:
+async def get_batch_embeddings(texts: list[str], deployment_name: str) -> list[list[float]]:
+    """
+    Generate embeddings for several text chunks in one request.
+    
+    Falls back to concurrent single-input requests if the deployment
+    rejects the batch (e.g. input count or token limits).
+    
+    Returns:
+        Embedding vectors in the same order as `texts`
+    """
+    try:
+        response = await client.embeddings.create(
+            input=texts,
+            model=deployment_name
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+    except BadRequestError as e:
+        logger.warning(f"Batch embedding request rejected, falling back to per-chunk requests: {e}")
+        return list(await asyncio.gather(
+            *(get_single_embedding(text, deployment_name) for text in texts)
+        ))
+
+
+async def generate_embedding(text: str, deployment_name: str, cache: bool = True) -> np.ndarray:
+    """
+    Embed normalized, non-empty text (chunking long texts) and cache the result.
+    """
+    # Check if text is short enough for single embedding
+    if len(text) <= MAX_CHARS:
+        logger.debug("Generating single embedding for text (%d chars)", len(text))
+        embedding = normalize_embedding(
+            np.asarray(await get_single_embedding(text, deployment_name), dtype=np.float32)
+        )
+    else:
+        embedding = await generate_chunked_embedding(text, deployment_name)
+    
+    if cache:
+        await _store_embedding(_cache_key(text), embedding)
+    return embedding
+
+
+async def _resolve_embedding(text: str, deployment_name: str) -> tuple[np.ndarray, bool]:
+    """
+    Embed normalized, non-empty text unless it is already cached.
+    
+    Returns:
+        Tuple of (embedding, whether it was served from a cache)
+    """
+    embedding = await _lookup_embedding(_cache_key(text))
+    if embedding is not None:
+        return embedding, True
+    return await generate_embedding(text, deployment_name), False
+
+
+async def generate_chunked_embedding(text: str, deployment_name: str) -> np.ndarray:
+    """
+    Embed text that exceeds the token limit by averaging chunk embeddings.
+    """
+    # Text is too long - use chunking
+    logger.info(f"Text too long ({len(text)} chars), using chunking strategy")
+    chunks = chunk_text(text)
+    
+    # Generate embeddings for all chunks in a single request
+    logger.debug("Generating embeddings for %d chunks", len(chunks))
+    embeddings = await get_batch_embeddings(chunks, deployment_name)
+    
+    # Average the embeddings
+    averaged_embedding = average_embeddings(embeddings)
+    logger.info(f"Generated averaged embedding from {len(chunks)} chunks")
+    
+    return averaged_embedding
+
+
+async def get_query_embedding(text: str, use_cache: bool = True) -> np.ndarray:
     """
     Generates an embedding for the given text using Azure OpenAI.
     
@@ -128,11 +402,19 @@ async def get_query_embedding(text: str) -> list[float]:
     overlapping chunks, each chunk is embedded separately, and the
     embeddings are averaged together.
     
+    Results are cached in-process by normalized query text, so repeated
+    queries skip the Azure OpenAI round-trip, and concurrent requests for
+    the same text share a single in-flight API call. When
+    EMBEDDING_CACHE_DB_PATH is set, embeddings are also persisted there.
+    get_query_cache_status() reports which of these served the call.
+    
     Args:
         text: The text to embed (can be a long JD or query)
+        use_cache: Set to False to neither read nor store the embedding
+            (e.g. for sensitive prompts)
     
     Returns:
-        Embedding vector as list of floats
+        Read-only, L2-normalized float32 embedding vector (empty for blank text)
     
     Raises:
         RuntimeError: If Azure OpenAI client is not initialized
@@ -148,36 +430,115 @@ async def get_query_embedding(text: str) -> list[float]:
             logger.error("AZURE_OPENAI_EMBEDDING_DEPLOYMENT not found in environment variables.")
             raise ValueError("AZURE_OPENAI_EMBEDDING_DEPLOYMENT not configured.")
 
+        _query_cache_status.set("MISS")
+        
         # Clean and standardize text
-        text = text.replace("\n", " ").strip()
-        # Remove excessive whitespace
-        text = " ".join(text.split())
+        text = normalize_text(text)
         
         if not text:
-            return []
-        
-        # Check if text is short enough for single embedding
-        if len(text) <= MAX_CHARS:
-            logger.debug(f"Generating single embedding for text ({len(text)} chars)")
-            return await get_single_embedding(text, deployment_name)
+            return np.empty(0, dtype=np.float32)
         
-        # Text is too long - use chunking
-        logger.info(f"Text too long ({len(text)} chars), using chunking strategy")
-        chunks = chunk_text(text)
+        if not use_cache:
+            return await generate_embedding(text, deployment_name, cache=False)
         
-        # Generate embeddings for each chunk
-        embeddings = []
-        for i, chunk in enumerate(chunks):
-            logger.debug(f"Generating embedding for chunk {i+1}/{len(chunks)} ({len(chunk)} chars)")
-            embedding = await get_single_embedding(chunk, deployment_name)
-            embeddings.append(embedding)
+        cache_key = _cache_key(text)
+        cached = _embedding_cache.get(cache_key)
+        if cached is not None:
+            _embedding_cache.move_to_end(cache_key)
+            logger.debug("Query embedding cache hit")
+            _query_cache_status.set("HIT")
+            return cached
         
-        # Average the embeddings
-        averaged_embedding = average_embeddings(embeddings)
-        logger.info(f"Generated averaged embedding from {len(chunks)} chunks")
+        # Coalesce concurrent requests for the same text into one API call
+        task = _inflight_requests.get(cache_key)
+        joined = task is not None
+        if task is None:
+            task = asyncio.ensure_future(_resolve_embedding(text, deployment_name))
+            _inflight_requests[cache_key] = task
+            task.add_done_callback(lambda _: _inflight_requests.pop(cache_key, None))
+        else:
+            logger.debug("Joining in-flight embedding request")
         
-        return averaged_embedding
+        # Shield so a cancelled caller does not cancel the shared request
+        embedding, from_cache = await asyncio.shield(task)
+        _query_cache_status.set("HIT" if joined or from_cache else "MISS")
+        return embedding
         
     except Exception as e:
         logger.error(f"Error generating embedding: {e}")
         raise e
+
+
+async def get_query_embeddings(
+    texts: list[str],
+    batch_size: int = EMBEDDING_BATCH_SIZE
+) -> list[np.ndarray]:
+    """
+    Generate embeddings for several texts using batched Azure OpenAI requests.
+    
+    Cached texts are served from the in-memory or persistent cache; the
+    remaining distinct texts are sent `batch_size` inputs per request, with at
+    most MAX_CONCURRENT_BATCHES requests in flight. Texts longer than
+    MAX_CHARS are chunked individually.
+    
+    Args:
+        texts: The texts to embed
+        batch_size: Maximum number of inputs per embeddings request
+    
+    Returns:
+        Read-only, L2-normalized float32 embedding vectors in the same order
+        as `texts` (empty for blank texts)
+    
+    Raises:
+        RuntimeError: If Azure OpenAI client is not initialized
+        ValueError: If deployment name is not configured
+    """
+    if not client:
+        logger.error("Azure OpenAI client is not initialized.")
+        raise RuntimeError("Azure OpenAI client is not initialized.")
+    
+    deployment_name = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    if not deployment_name:
+        logger.error("AZURE_OPENAI_EMBEDDING_DEPLOYMENT not found in environment variables.")
+        raise ValueError("AZURE_OPENAI_EMBEDDING_DEPLOYMENT not configured.")
+    
+    normalized = [normalize_text(text) for text in texts]
+    embeddings: dict[str, np.ndarray] = {"": np.empty(0, dtype=np.float32)}
+    short_texts = []
+    long_texts = []
+    
+    for text in dict.fromkeys(normalized):
+        if text in embeddings:
+            continue
+        cached = await _lookup_embedding(_cache_key(text))
+        if cached is not None:
+            embeddings[text] = cached
+        elif len(text) <= MAX_CHARS:
+            short_texts.append(text)
+        else:
+            long_texts.append(text)
+    
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+    
+    async def embed_batch(batch: list[str]) -> None:
+        async with semaphore:
+            vectors = await get_batch_embeddings(batch, deployment_name)
+        for text, vector in zip(batch, vectors):
+            embedding = normalize_embedding(np.asarray(vector, dtype=np.float32))
+            await _store_embedding(_cache_key(text), embedding)
+            embeddings[text] = embedding
+    
+    async def embed_long(text: str) -> None:
+        async with semaphore:
+            embeddings[text] = await generate_embedding(text, deployment_name)
+    
+    logger.info(
+        f"Embedding {len(short_texts) + len(long_texts)} uncached texts "
+        f"({len(texts)} requested) in batches of {batch_size}"
+    )
+    await asyncio.gather(
+        *(embed_batch(short_texts[i:i + batch_size]) for i in range(0, len(short_texts), batch_size)),
+        *(embed_long(text) for text in long_texts)
+    )
+    
+    return [embeddings[text] for text in normalized]
@@ -3,10 +3,18 @@ Recommendation Service
 Orchestrates the recommendation pipeline: embedding generation → hybrid search.
 """
 import os
+import time
+import asyncio
 import logging
+from typing import Optional
+from dataclasses import dataclass
+from collections import deque
+
+import numpy as np
 
 from app.services.embedding_service import get_query_embedding
-from app.services.vector_search_service import hybrid_search, SearchResult
+from app.services.database_service import ProductCatalog, get_product_catalog
+from app.services.vector_search_service import hybrid_search, tokenize, SearchResult
 
 logger = logging.getLogger(__name__)
 
@@ -16,12 +24,88 @@ DB_PATH = os.path.join(
     "shl_products.db"
 )
 
+# Semantic result cache: a query whose embedding is at least this similar to a
+# recent query (with the same keywords and search parameters) reuses that
+# query's results
+RESULT_CACHE_SIMILARITY = 0.97
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+
+
+@dataclass
+class CachedRecommendation:
+    """Recommendations computed for a recent query."""
+    embedding: np.ndarray  # normalized query embedding
+    params: tuple  # (top_k, semantic_weight, keyword_weight, sorted query tokens)
+    catalog: ProductCatalog
+    results: list[SearchResult]
+    created_at: float
+
+
+_result_cache: deque[CachedRecommendation] = deque(maxlen=RESULT_CACHE_SIZE)
+
+
+def prune_result_cache(catalog: ProductCatalog) -> None:
+    """
+    Drop cached results that have expired or were computed against another
+    catalog, so catalogs superseded by a database change can be freed.
+    """
+    now = time.monotonic()
+    fresh = [
+        entry for entry in _result_cache
+        if entry.catalog is catalog
+        and now - entry.created_at < RESULT_CACHE_TTL_SECONDS
+    ]
+    if len(fresh) < len(_result_cache):
+        _result_cache.clear()
+        _result_cache.extend(fresh)
+
+
+def find_cached_results(
+    query_vector: np.ndarray,
+    params: tuple,
+    catalog: ProductCatalog
+) -> Optional[list[SearchResult]]:
+    """
+    Find results of a recent, semantically equivalent query.
+    
+    Args:
+        query_vector: L2-normalized query embedding
+        params: Search parameters and query tokens that must match exactly
+        catalog: Catalog the results must have been computed against
+    
+    Returns:
+        Cached results, or None if no fresh entry is similar enough
+    """
+    prune_result_cache(catalog)
+    entries = [entry for entry in _result_cache if entry.params == params]
+    if not entries:
+        return None
+    
+    similarities = np.stack([entry.embedding for entry in entries]) @ query_vector
+    best = int(np.argmax(similarities))
+    if similarities[best] < RESULT_CACHE_SIMILARITY:
+        return None
+    
+    logger.debug("Result cache hit (similarity %.4f)", similarities[best])
+    return entries[best].results
+
+
+def load_product_catalog() -> ProductCatalog:
+    """
+    Load the product catalog (metadata and normalized embedding matrix).
+    Called at application startup to warm the catalog cache.
+    """
+    return get_product_catalog(DB_PATH)
+
 
 async def get_recommendations(
     query: str,
     top_k: int = 10,
     semantic_weight: float = 0.6,
-    keyword_weight: float = 0.4
+    keyword_weight: float = 0.4,
+    catalog: Optional[ProductCatalog] = None,
+    no_cache: bool = False
 ) -> list[SearchResult]:
     """
     Get product recommendations based on a natural language query.
@@ -36,6 +120,9 @@ async def get_recommendations(
         top_k: Number of top results to return
         semantic_weight: Weight for semantic similarity
         keyword_weight: Weight for keyword matching
+        catalog: Product catalog to search (defaults to the cached catalog,
+            reloaded if the database has changed)
+        no_cache: Bypass the embedding and result caches (e.g. for sensitive prompts)
     
     Returns:
         List of SearchResult objects sorted by relevance
@@ -49,30 +136,60 @@ async def get_recommendations(
     # Step 1: Generate embedding for the query
     try:
         logger.debug("Generating query embedding...")
-        query_embedding = await get_query_embedding(query)
+        query_embedding = await get_query_embedding(query, use_cache=not no_cache)
         
-        if not query_embedding:
+        if len(query_embedding) == 0:
             raise RuntimeError("Failed to generate embedding: empty result")
         
-        logger.debug(f"Generated embedding with {len(query_embedding)} dimensions")
+        logger.debug("Generated embedding with %d dimensions", len(query_embedding))
     
     except Exception as e:
         logger.error(f"Embedding generation failed: {e}")
         raise RuntimeError(f"Failed to generate query embedding: {e}")
     
+    if catalog is None:
+        # A stat() when the cached catalog is current; a full reload (off the
+        # event loop) after the crawler or embedder has written to the database
+        catalog = await asyncio.to_thread(get_product_catalog, DB_PATH)
+    
+    # Near-duplicate queries reuse recent results. Keyword scores depend on
+    # the query's tokens (and their counts), not its embedding, so those must
+    # match too
+    params = (top_k, semantic_weight, keyword_weight, tuple(sorted(tokenize(query))))
+    if not no_cache:
+        cached = find_cached_results(query_embedding, params, catalog)
+        if cached is not None:
+            logger.info(f"Returning {len(cached)} cached recommendations for query")
+            return cached
+    
     # Step 2: Perform hybrid search
     try:
-        logger.debug(f"Performing hybrid search (top_k={top_k})...")
-        results = hybrid_search(
+        logger.debug("Performing hybrid search (top_k=%d)...", top_k)
+        # CPU-bound scoring runs in a worker thread so it does not block the
+        # event loop (NumPy releases the GIL during the matrix-vector product)
+        results = await asyncio.to_thread(
+            hybrid_search,
             query=query,
             query_embedding=query_embedding,
             top_k=top_k,
             db_path=DB_PATH,
             semantic_weight=semantic_weight,
-            keyword_weight=keyword_weight
+            keyword_weight=keyword_weight,
+            catalog=catalog
         )
         
         logger.info(f"Found {len(results)} recommendations for query")
+        
+        if not no_cache:
+            # The catalog may have been reloaded while the search ran
+            prune_result_cache(catalog)
+            _result_cache.append(CachedRecommendation(
+                embedding=query_embedding,
+                params=params,
+                catalog=catalog,
+                results=results,
+                created_at=time.monotonic()
+            ))
         return results
     
     except Exception as e:
@@ -0,0 +1,192 @@
+"""
+Search Index Service
+Approximate nearest-neighbour index over product embeddings using FAISS,
+and int8-quantized exact scoring using SimSIMD.
+
+FAISS (`ann` extra) and SimSIMD (`simd` extra) are optional dependencies.
+When they are not available, hybrid search falls back to the exact
+float32 NumPy scan.
+"""
+import os
+import logging
+from typing import Any, Optional
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+logger = logging.getLogger(__name__)
+
+# FAISS index factory string. HNSW32 keeps full vectors with O(log N) search;
+# "OPQ16_64,IVF256,PQ16" trades some recall for a much smaller memory footprint.
+INDEX_FACTORY = os.getenv("SEARCH_INDEX_FACTORY", "HNSW32")
+
+# HNSW graph construction depth: higher values build a better-connected graph
+# (higher recall) at the cost of a slower one-off build
+HNSW_EF_CONSTRUCTION = int(os.getenv("SEARCH_INDEX_EF_CONSTRUCTION", "200"))
+
+# Below this catalog size an exact scan is cheap and ranks every product,
+# so the ANN index is only used for larger catalogs
+MIN_INDEX_SIZE = int(os.getenv("SEARCH_INDEX_MIN_SIZE", "5000"))
+
+# Set to "int8" to score against an int8-quantized copy of the embedding
+# matrix (requires SimSIMD for VNNI/NEON int8 dot products)
+QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "").lower()
+
+
+def is_available() -> bool:
+    """
+    Check whether FAISS is installed.
+    """
+    return faiss is not None
+
+
+def should_index(num_vectors: int) -> bool:
+    """
+    Check whether a catalog of this size should be served from an ANN index.
+    """
+    return is_available() and num_vectors >= MIN_INDEX_SIZE
+
+
+def build_index(embeddings: np.ndarray, factory: str = INDEX_FACTORY) -> Any:
+    """
+    Build an inner-product index over L2-normalized embeddings.
+
+    Inner product on unit vectors equals cosine similarity.
+
+    Args:
+        embeddings: (N, D) float32 matrix with L2-normalized rows
+        factory: FAISS index factory string
+
+    Returns:
+        Populated FAISS index
+    """
+    if faiss is None:
+        raise RuntimeError("FAISS is not installed")
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = faiss.index_factory(embeddings.shape[1], factory, faiss.METRIC_INNER_PRODUCT)
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+
+    logger.info(f"Built FAISS index '{factory}' over {index.ntotal} vectors")
+    return index
+
+
+def load_or_build_index(
+    embeddings: np.ndarray,
+    index_path: Optional[str] = None,
+    source_mtime: Optional[float] = None,
+    factory: str = INDEX_FACTORY
+) -> Any:
+    """
+    Load a persisted index if it is still current, otherwise build (and persist) one.
+
+    Args:
+        embeddings: (N, D) float32 matrix with L2-normalized rows
+        index_path: Where to persist the index (None disables persistence)
+        source_mtime: Modification time of the data the embeddings came from;
+            a persisted index older than this is rebuilt
+        factory: FAISS index factory string
+
+    Returns:
+        Populated FAISS index
+    """
+    if faiss is None:
+        raise RuntimeError("FAISS is not installed")
+
+    if index_path and os.path.exists(index_path):
+        is_stale = source_mtime is not None and source_mtime > os.path.getmtime(index_path)
+        if not is_stale:
+            try:
+                index = faiss.read_index(index_path)
+                if index.ntotal == embeddings.shape[0] and index.d == embeddings.shape[1]:
+                    logger.info(f"Loaded FAISS index from {index_path}")
+                    return index
+            except RuntimeError as e:
+                logger.warning(f"Failed to read FAISS index {index_path}: {e}")
+
+    index = build_index(embeddings, factory)
+
+    if index_path:
+        try:
+            faiss.write_index(index, index_path)
+        except RuntimeError as e:
+            logger.warning(f"Failed to persist FAISS index to {index_path}: {e}")
+
+    return index
+
+
+def search(index: Any, query_vector: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the k nearest rows to a normalized query vector.
+
+    Returns:
+        Tuple of (scores, row indices), best first
+    """
+    k = min(k, index.ntotal)
+    query = np.ascontiguousarray(query_vector, dtype=np.float32).reshape(1, -1)
+    scores, indices = index.search(query, k)
+
+    # FAISS pads with -1 when fewer than k neighbours are found
+    found = indices[0] >= 0
+    return scores[0][found], indices[0][found]
+
+
+def should_quantize() -> bool:
+    """
+    Check whether int8 quantized scoring is enabled and supported.
+    """
+    if QUANTIZATION != "int8":
+        return False
+    if simsimd is None:
+        logger.warning("EMBEDDING_QUANTIZATION=int8 requires SimSIMD; using float32 scoring")
+        return False
+    return True
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize rows to int8 with a symmetric per-row scale.
+
+    Args:
+        vectors: (N, D) or (D,) float32 array
+
+    Returns:
+        Tuple of (int8 codes, float32 scales) where vectors ≈ codes * scales
+    """
+    vectors = np.atleast_2d(vectors)
+    max_abs = np.max(np.abs(vectors), axis=1, keepdims=True)
+    max_abs[max_abs == 0] = 1.0
+    scales = (max_abs / 127.0).astype(np.float32)
+    codes = np.round(vectors / scales).astype(np.int8)
+    return codes, scales.ravel()
+
+
+def int8_scores(codes: np.ndarray, scales: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+    """
+    Approximate the inner product of every quantized row with a query vector.
+
+    Args:
+        codes: (N, D) int8 matrix from quantize_int8
+        scales: (N,) per-row scales from quantize_int8
+        query_vector: (D,) float32 query
+
+    Returns:
+        (N,) float32 scores
+    """
+    query_codes, query_scale = quantize_int8(query_vector)
+    dots = np.asarray(simsimd.cdist(codes, query_codes, metric="dot"), dtype=np.float32).ravel()
+    return dots * scales * query_scale[0]
@@ -5,11 +5,20 @@ Provides hybrid search combining semantic embeddings with keyword boosting.
 import math
 import re
 import logging
+import threading
 from typing import Optional
 from dataclasses import dataclass
-from collections import Counter
+from collections import Counter, defaultdict
 
-from app.services.database_service import Product, get_all_products, DEFAULT_DB_PATH
+import numpy as np
+
+from app.services import search_index
+from app.services.database_service import (
+    Product,
+    ProductCatalog,
+    get_product_catalog,
+    DEFAULT_DB_PATH
+)
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +26,11 @@ logger = logging.getLogger(__name__)
 SEMANTIC_WEIGHT = 0.6  # Weight for cosine similarity
 KEYWORD_WEIGHT = 0.4   # Weight for keyword matching
 
+# When an ANN index is available, this many candidates per requested result
+# are retrieved semantically, plus as many top keyword matches, and the pool
+# is re-ranked with exact hybrid scores
+ANN_CANDIDATE_FACTOR = 10
+
 # Field-specific boost multipliers for keyword matching
 FIELD_BOOSTS = {
     "name": 3.0,           # Product name is most important
@@ -25,8 +39,11 @@ FIELD_BOOSTS = {
     "description": 1.0,    # Description has base weight
 }
 
+# Word tokens of already-lowercased text
+_TOKEN_RE = re.compile(r'\b[a-z]+\b')
+
 # Common stopwords to ignore in keyword matching
-STOPWORDS = {
+STOPWORDS = frozenset({
     "a", "an", "the", "is", "are", "was", "were", "be", "been", "being",
     "have", "has", "had", "do", "does", "did", "will", "would", "could",
     "should", "may", "might", "must", "shall", "can", "need", "dare",
@@ -36,17 +53,15 @@ STOPWORDS = {
     "there", "when", "where", "why", "how", "all", "each", "few", "more",
     "most", "other", "some", "such", "no", "nor", "not", "only", "own",
     "same", "so", "than", "too", "very", "just", "and", "but", "if", "or",
-    "because", "until", "while", "about", "against", "between", "into",
-    "through", "during", "before", "after", "above", "below", "up", "down",
-    "out", "off", "over", "under", "again", "further", "then", "once",
-    "i", "me", "my", "myself", "we", "our", "ours", "ourselves", "you",
-    "your", "yours", "yourself", "yourselves", "he", "him", "his", "himself",
-    "she", "her", "hers", "herself", "it", "its", "itself", "they", "them",
-    "their", "theirs", "themselves", "what", "which", "who", "whom", "this",
-    "that", "these", "those", "am", "is", "are", "was", "were", "be", "been",
-    "being", "have", "has", "had", "having", "do", "does", "did", "doing",
-    "test", "tests", "testing", "assessment", "assessments"
-}
+    "because", "until", "while", "about", "against", "up", "down", "out",
+    "off", "over", "i", "me", "my", "myself", "we", "our", "ours",
+    "ourselves", "you", "your", "yours", "yourself", "yourselves", "he",
+    "him", "his", "himself", "she", "her", "hers", "herself", "it", "its",
+    "itself", "they", "them", "their", "theirs", "themselves", "what",
+    "which", "who", "whom", "this", "that", "these", "those", "am",
+    "having", "doing", "test", "tests", "testing", "assessment",
+    "assessments"
+})
 
 
 @dataclass
@@ -56,6 +71,35 @@ class SearchResult:
     similarity_score: float
 
 
+@dataclass
+class FieldPostings:
+    """
+    Inverted index for one product field.
+    Each term maps to (product rows, term frequencies, term positions), where
+    the position is the term's first-occurrence order within that field.
+    """
+    boost: float
+    postings: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]]
+    trigrams: dict[str, set[str]]  # 3-gram -> field terms containing it
+    has_tokens: np.ndarray  # (N,) bool, whether the field has any tokens
+
+
+@dataclass
+class KeywordIndex:
+    """
+    Precomputed keyword data for a catalog, so that per query only the
+    query side is tokenized and scores are computed with array operations.
+    """
+    fields: list[FieldPostings]
+    boost_totals: np.ndarray  # (N,) sum of boosts of fields that have tokens
+    remote_testing: np.ndarray  # (N,) bool
+    adaptive_irt: np.ndarray  # (N,) bool
+
+
+# Guards lazy construction of a catalog's keyword index
+_keyword_index_lock = threading.Lock()
+
+
 def tokenize(text: str) -> list[str]:
     """
     Tokenize text into lowercase words, removing punctuation and stopwords.
@@ -63,8 +107,7 @@ def tokenize(text: str) -> list[str]:
     if not text:
         return []
     
-    words = re.findall(r'\b[a-zA-Z]+\b', text.lower())
-    return [w for w in words if w not in STOPWORDS and len(w) > 2]
+    return [w for w in _TOKEN_RE.findall(text.lower()) if len(w) > 2 and w not in STOPWORDS]
 
 
 def compute_tf(tokens: list[str]) -> dict[str, float]:
@@ -79,154 +122,296 @@ def compute_tf(tokens: list[str]) -> dict[str, float]:
     return {term: 1 + math.log(count) for term, count in counts.items()}
 
 
-def cosine_similarity(vec_a: list[float], vec_b: list[float]) -> float:
+def select_top_k(scores: np.ndarray, k: int) -> np.ndarray:
     """
-    Compute cosine similarity between two vectors.
+    Return the indices of the k highest scores, best first.
     
-    Cosine similarity = (A · B) / (||A|| × ||B||)
+    Uses argpartition (O(N)) and only sorts the selected k entries,
+    instead of sorting all N scores.
     """
-    if len(vec_a) != len(vec_b):
-        raise ValueError(f"Vector dimensions do not match: {len(vec_a)} vs {len(vec_b)}")
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
     
-    if len(vec_a) == 0:
-        return 0.0
+    if k < len(scores):
+        top = np.argpartition(-scores, k)[:k]
+    else:
+        top = np.arange(len(scores))
     
-    dot_product = sum(a * b for a, b in zip(vec_a, vec_b))
-    magnitude_a = math.sqrt(sum(a * a for a in vec_a))
-    magnitude_b = math.sqrt(sum(b * b for b in vec_b))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def get_trigrams(term: str) -> set[str]:
+    """
+    Return the set of 3-character substrings of a term.
+    """
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+def build_keyword_index(catalog: ProductCatalog) -> KeywordIndex:
+    """
+    Tokenize every product field once and build per-field inverted indexes.
+    """
+    fields = []
+    boost_totals = np.zeros(len(catalog))
     
-    if magnitude_a == 0 or magnitude_b == 0:
-        return 0.0
+    for field_name, boost in FIELD_BOOSTS.items():
+        term_entries: dict[str, tuple[list, list, list]] = defaultdict(lambda: ([], [], []))
+        has_tokens = np.zeros(len(catalog), dtype=bool)
+        
+        for row, value in enumerate(catalog.column(field_name)):
+            field_tf = compute_tf(tokenize(value or ""))
+            if not field_tf:
+                continue
+            
+            has_tokens[row] = True
+            for position, (term, tf) in enumerate(field_tf.items()):
+                rows, tfs, positions = term_entries[term]
+                rows.append(row)
+                tfs.append(tf)
+                positions.append(position)
+        
+        postings = {
+            term: (
+                np.array(rows, dtype=np.intp),
+                np.array(tfs, dtype=np.float64),
+                np.array(positions, dtype=np.intp)
+            )
+            for term, (rows, tfs, positions) in term_entries.items()
+        }
+        trigrams: dict[str, set[str]] = defaultdict(set)
+        for term in postings:
+            for trigram in get_trigrams(term):
+                trigrams[trigram].add(term)
+        
+        fields.append(FieldPostings(
+            boost=boost,
+            postings=postings,
+            trigrams=dict(trigrams),
+            has_tokens=has_tokens
+        ))
+        boost_totals += boost * has_tokens
     
-    return dot_product / (magnitude_a * magnitude_b)
+    return KeywordIndex(
+        fields=fields,
+        boost_totals=boost_totals,
+        remote_testing=catalog.remote_testing > 0,
+        adaptive_irt=catalog.adaptive_irt > 0
+    )
+
+
+def get_keyword_index(catalog: ProductCatalog) -> KeywordIndex:
+    """
+    Return the catalog's keyword index, building it on first use.
+    """
+    if catalog.keyword_index is None:
+        with _keyword_index_lock:
+            if catalog.keyword_index is None:
+                catalog.keyword_index = build_keyword_index(catalog)
+                logger.info(f"Built keyword index for {len(catalog)} products")
+    return catalog.keyword_index
 
 
-def compute_keyword_score(query_tokens: list[str], product: Product) -> float:
+def find_partial_matches(
+    field: FieldPostings,
+    term: str,
+    exact_rows: Optional[np.ndarray]
+) -> Optional[tuple[np.ndarray, np.ndarray]]:
     """
-    Compute keyword matching score between query and product fields.
+    Find partial (substring) matches of a query term in one field.
+    
+    For every product without an exact match, the credited field term is the
+    first one (in field order) that contains the query term or is contained
+    in it.
+    
+    Returns:
+        Tuple of (product rows, term frequencies), or None if nothing matches
+    """
+    # Field terms containing the query term share all of its trigrams
+    candidate_sets = [field.trigrams.get(trigram) for trigram in get_trigrams(term)]
+    if candidate_sets and all(candidate_sets):
+        containing = {t for t in set.intersection(*candidate_sets) if term in t}
+    else:
+        containing = set()
+    
+    # Field terms contained in the query term are among its substrings
+    # (tokens are at least 3 characters long)
+    contained = {
+        term[i:j]
+        for i in range(len(term) - 2)
+        for j in range(i + 3, len(term) + 1)
+    }
+    
+    matched_terms = (containing | (contained & field.postings.keys())) - {term}
+    if not matched_terms:
+        return None
+    matches = [field.postings[t] for t in matched_terms]
+    
+    rows = np.concatenate([m[0] for m in matches])
+    tfs = np.concatenate([m[1] for m in matches])
+    positions = np.concatenate([m[2] for m in matches])
+    
+    if exact_rows is not None:
+        keep = ~np.isin(rows, exact_rows)
+        rows, tfs, positions = rows[keep], tfs[keep], positions[keep]
+    
+    # Keep the earliest matching term per product
+    order = np.lexsort((positions, rows))
+    rows, tfs = rows[order], tfs[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = rows[1:] != rows[:-1]
+    return rows[first], tfs[first]
+
+
+def compute_keyword_scores(query_tokens: list[str], keyword_index: KeywordIndex) -> np.ndarray:
+    """
+    Compute keyword matching scores between the query and every product.
     Uses a BM25-inspired approach with field boosting.
+    
+    Returns:
+        (N,) float32 array of scores in [0, 1]
     """
+    num_products = len(keyword_index.boost_totals)
     if not query_tokens:
-        return 0.0
+        return np.zeros(num_products, dtype=np.float32)
     
     query_tf = compute_tf(query_tokens)
-    total_score = 0.0
-    max_possible_score = 0.0
+    total_scores = np.zeros(num_products)
     
-    # Score each field with its boost
-    fields = {
-        "name": product.name or "",
-        "test_type": product.test_type or "",
-        "job_levels": product.job_levels or "",
-        "description": product.description or "",
-    }
+    # Every field with tokens can contribute at most the boosted query weight
+    max_possible_scores = sum(query_tf.values()) * keyword_index.boost_totals
     
-    for field_name, field_value in fields.items():
-        field_tokens = tokenize(field_value)
-        if not field_tokens:
-            continue
-        
-        field_tf = compute_tf(field_tokens)
-        boost = FIELD_BOOSTS.get(field_name, 1.0)
-        
+    # Score each field with its boost
+    for field in keyword_index.fields:
         for term, query_weight in query_tf.items():
-            max_possible_score += query_weight * boost
+            exact = field.postings.get(term)
+            exact_rows = None
+            if exact is not None:
+                exact_rows, tfs, _ = exact
+                total_scores[exact_rows] += query_weight * tfs * field.boost
             
-            if term in field_tf:
-                total_score += query_weight * field_tf[term] * boost
-            else:
-                for field_term in field_tf:
-                    if term in field_term or field_term in term:
-                        total_score += query_weight * field_tf[field_term] * boost * 0.5
-                        break
+            partial = find_partial_matches(field, term, exact_rows)
+            if partial is not None:
+                rows, tfs = partial
+                total_scores[rows] += query_weight * tfs * field.boost * 0.5
     
     # Boolean feature matching
-    if "remote" in query_tokens and product.remote_testing:
-        total_score += 2.0
-        max_possible_score += 2.0
-    
-    if ("adaptive" in query_tokens or "irt" in query_tokens) and product.adaptive_irt:
-        total_score += 2.0
-        max_possible_score += 2.0
+    if "remote" in query_tokens:
+        total_scores += 2.0 * keyword_index.remote_testing
+        max_possible_scores = max_possible_scores + 2.0 * keyword_index.remote_testing
     
-    if max_possible_score > 0:
-        return min(1.0, total_score / max_possible_score)
+    if "adaptive" in query_tokens or "irt" in query_tokens:
+        total_scores += 2.0 * keyword_index.adaptive_irt
+        max_possible_scores = max_possible_scores + 2.0 * keyword_index.adaptive_irt
     
-    return 0.0
+    scores = np.zeros(num_products, dtype=np.float32)
+    scorable = max_possible_scores > 0
+    scores[scorable] = np.minimum(1.0, total_scores[scorable] / max_possible_scores[scorable])
+    return scores
 
 
 def hybrid_search(
     query: str,
-    query_embedding: list[float],
+    query_embedding: np.ndarray,
     top_k: int = 10,
     db_path: str = DEFAULT_DB_PATH,
     semantic_weight: float = SEMANTIC_WEIGHT,
-    keyword_weight: float = KEYWORD_WEIGHT
+    keyword_weight: float = KEYWORD_WEIGHT,
+    catalog: Optional[ProductCatalog] = None
 ) -> list[SearchResult]:
     """
     Perform hybrid search combining semantic similarity with keyword boosting.
     
     Args:
         query: Original query text for keyword matching
-        query_embedding: The embedding vector of the query
+        query_embedding: The L2-normalized float32 embedding vector of the query
         top_k: Number of top results to return
         db_path: Path to the SQLite database
         semantic_weight: Weight for semantic similarity
         keyword_weight: Weight for keyword matching
+        catalog: Preloaded product catalog (loaded from db_path if omitted)
     
     Returns:
         List of SearchResult objects sorted by combined score
     """
-    if not query_embedding:
+    if query_embedding is None or len(query_embedding) == 0:
         logger.warning("Empty query embedding provided")
         return []
     
     query_tokens = tokenize(query)
-    logger.debug(f"Query tokens: {query_tokens}")
+    logger.debug("Query tokens: %s", query_tokens)
     
-    products = get_all_products(db_path)
+    if catalog is None:
+        catalog = get_product_catalog(db_path)
     
-    if not products:
+    if len(catalog) == 0:
         logger.warning("No products found in database")
         return []
     
-    results: list[tuple[SearchResult, float]] = []
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    if query_vector.shape[0] != catalog.embeddings.shape[1]:
+        logger.warning(
+            f"Vector dimensions do not match: {query_vector.shape[0]} vs {catalog.embeddings.shape[1]}"
+        )
+        return []
+    
+    # Keyword matching
+    keyword_scores = compute_keyword_scores(query_tokens, get_keyword_index(catalog))
     
-    for product in products:
-        if not product.embedding:
-            continue
-        
-        # Semantic similarity
-        try:
-            semantic_score = cosine_similarity(query_embedding, product.embedding)
-            semantic_score_normalized = (semantic_score + 1) / 2
-        except ValueError as e:
-            logger.warning(f"Skipping product {product.id}: {e}")
-            continue
-        
-        # Keyword matching
-        keyword_score = compute_keyword_score(query_tokens, product)
-        
-        # Combined score
-        combined_score = (
-            semantic_weight * semantic_score_normalized +
-            keyword_weight * keyword_score
+    if catalog.index is not None:
+        # Approximate nearest neighbours narrow the catalog to a candidate pool
+        # that is then re-ranked with keyword scores
+        num_candidates = top_k * ANN_CANDIDATE_FACTOR
+        semantic_scores, candidates = search_index.search(
+            catalog.index, query_vector, num_candidates
         )
         
-        result = SearchResult(
-            product=product,
-            similarity_score=round(combined_score, 6)
+        # Strong keyword matches can rank highly on a weaker semantic score,
+        # so the best keyword rows join the pool, scored exactly
+        keyword_rows = select_top_k(keyword_scores, min(num_candidates, len(catalog)))
+        keyword_rows = keyword_rows[keyword_scores[keyword_rows] > 0]
+        extra_rows = np.setdiff1d(keyword_rows, candidates)
+        if len(extra_rows) > 0:
+            candidates = np.concatenate([candidates, extra_rows])
+            semantic_scores = np.concatenate([
+                semantic_scores, catalog.embeddings[extra_rows] @ query_vector
+            ])
+        keyword_scores = keyword_scores[candidates]
+    elif catalog.quantized is not None:
+        # Same scan on the int8 copy of the matrix, using SIMD int8 dot products
+        semantic_scores = search_index.int8_scores(
+            catalog.quantized, catalog.quantization_scales, query_vector
         )
-        
-        results.append((result, combined_score))
-        
-        logger.debug(
-            f"Product '{product.name}': semantic={semantic_score:.4f}, "
-            f"keyword={keyword_score:.4f}, combined={combined_score:.4f}"
+        candidates = np.arange(len(catalog))
+    else:
+        # Semantic similarity: rows are pre-normalized, so one matrix-vector product
+        # yields the cosine similarity against every product
+        semantic_scores = catalog.embeddings @ query_vector
+        candidates = np.arange(len(catalog))
+    
+    # Combined score, with semantic scores mapped from [-1, 1] to [0, 1];
+    # built in place to avoid full-size temporaries
+    combined_scores = semantic_scores + np.float32(1.0)
+    combined_scores *= np.float32(semantic_weight * 0.5)
+    combined_scores += np.float32(keyword_weight) * keyword_scores
+    
+    top_indices = select_top_k(combined_scores, top_k)
+    
+    top_results = [
+        SearchResult(
+            product=catalog.get_product(candidates[i]),
+            similarity_score=round(float(combined_scores[i]), 6)
         )
+        for i in top_indices
+    ]
     
-    results.sort(key=lambda x: x[1], reverse=True)
-    top_results = [r[0] for r in results[:top_k]]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Scored %d candidates; top semantic=%s keyword=%s combined=%s",
+            len(candidates),
+            np.array2string(semantic_scores[top_indices], precision=4, separator=", ", max_line_width=10_000),
+            np.array2string(keyword_scores[top_indices], precision=4, separator=", ", max_line_width=10_000),
+            np.array2string(combined_scores[top_indices], precision=4, separator=", ", max_line_width=10_000)
+        )
     
     logger.info(f"Hybrid search completed: found {len(top_results)} results (top {top_k})")
     
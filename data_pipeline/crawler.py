@@ -1,11 +1,12 @@
-import requests
-from bs4 import BeautifulSoup
-import sqlite3
-import time
+import aiohttp
+import asyncio
+from selectolax.lexbor import LexborHTMLParser
+import hashlib
+import json
 import logging
 import os
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from db import connect_db
 
 # Configure logging
 logging.basicConfig(
@@ -18,101 +19,195 @@ BASE_URL = "https://www.shl.com"
 CATALOG_BASE_URL = f"{BASE_URL}/products/product-catalog/"
 DB_NAME = "shl_products.db"
 
+# Scraped products are written to the database in transactions of this size
+SAVE_BATCH_SIZE = 100
+
+# Retry policy for page fetches: exponential back-off (0.5s, 1s, ...) on
+# connection errors and on these transient HTTP statuses
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Optional politeness limit shared by all concurrent fetches, in requests per
+# second; None (the default) leaves the crawl bounded only by max_concurrency
+MAX_REQUESTS_PER_SECOND = None
+
+# Catalog pagination: products per page, and the last `start` offset crawled
+CATALOG_PAGE_SIZE = 12
+MAX_CATALOG_START = 500
+
+# Detail page <h4> label substrings and the product field each one fills,
+# checked in order
+DETAIL_FIELDS = {
+    "description": "description",
+    "job levels": "job_levels",
+    "languages": "languages",
+    "assessment length": "assessment_length",
+}
+DIGITS_RE = re.compile(r'\d+')
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 }
 
+def next_element_sibling(node):
+    # Skip text and comment nodes between the heading and its content
+    sibling = node.next
+    while sibling is not None and not sibling.is_element_node:
+        sibling = sibling.next
+    return sibling
+
+def content_hash(product_data):
+    return hashlib.blake2s(json.dumps(product_data, sort_keys=True).encode()).hexdigest()[:16]
+
+class RateLimiter:
+    """Token bucket: allows bursts of up to `rate` requests, refilled at `rate` per second."""
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = None
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if self.updated is not None:
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated = asyncio.get_running_loop().time()
+            self.tokens -= 1
+
 class SHLCrawler:
-    def __init__(self, db_path=DB_NAME, max_workers=10):
+    def __init__(self, db_path=DB_NAME, max_concurrency=16, max_requests_per_second=MAX_REQUESTS_PER_SECOND):
         self.db_path = db_path
-        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self.max_requests_per_second = max_requests_per_second
+        self.session = None
+        self.semaphore = None
+        self.rate_limiter = None
+        # One connection for the whole crawl; all writes happen on the event loop thread.
+        # Autocommit mode; transactions are opened explicitly with BEGIN
+        self.conn = connect_db(db_path, isolation_level=None)
         self.init_db()
 
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    url TEXT UNIQUE NOT NULL,
-                    remote_testing BOOLEAN,
-                    adaptive_irt BOOLEAN,
-                    test_type TEXT,
-                    description TEXT,
-                    job_levels TEXT,
-                    languages TEXT,
-                    assessment_length TEXT,
-                    crawled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            conn.commit()
-
-    def save_product(self, product_data):
-        # SQLite is better with one connection per write or careful locking
-        # For simplicity in this parallel script, we open a connection per save
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                url TEXT UNIQUE NOT NULL,
+                remote_testing BOOLEAN,
+                adaptive_irt BOOLEAN,
+                test_type TEXT,
+                description TEXT,
+                job_levels TEXT,
+                languages TEXT,
+                assessment_length TEXT,
+                content_hash TEXT,
+                crawled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Databases created before content hashing get the column added
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(products)')]
+        if 'content_hash' not in columns:
+            self.conn.execute('ALTER TABLE products ADD COLUMN content_hash TEXT')
+
+    def close(self):
+        self.conn.close()
+
+    def save_products(self, products):
+        # Upsert a whole batch in a single transaction (one commit per batch).
+        # Rows whose content hash is unchanged are skipped rather than rewritten.
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO products (
-                        name, url, remote_testing, adaptive_irt, test_type,
-                        description, job_levels, languages, assessment_length
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(url) DO UPDATE SET
-                        name=excluded.name,
-                        remote_testing=excluded.remote_testing,
-                        adaptive_irt=excluded.adaptive_irt,
-                        test_type=excluded.test_type,
-                        description=excluded.description,
-                        job_levels=excluded.job_levels,
-                        languages=excluded.languages,
-                        assessment_length=excluded.assessment_length,
-                        crawled_at=CURRENT_TIMESTAMP
-                ''', (
-                    product_data['name'],
-                    product_data['url'],
-                    product_data['remote_testing'],
-                    product_data['adaptive_irt'],
-                    product_data['test_type'],
-                    product_data.get('description'),
-                    product_data.get('job_levels'),
-                    product_data.get('languages'),
-                    product_data.get('assessment_length')
-                ))
-                conn.commit()
+            self.conn.execute('BEGIN')
+            self.conn.executemany('''
+                INSERT INTO products (
+                    name, url, remote_testing, adaptive_irt, test_type,
+                    description, job_levels, languages, assessment_length,
+                    content_hash
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    name=excluded.name,
+                    remote_testing=excluded.remote_testing,
+                    adaptive_irt=excluded.adaptive_irt,
+                    test_type=excluded.test_type,
+                    description=excluded.description,
+                    job_levels=excluded.job_levels,
+                    languages=excluded.languages,
+                    assessment_length=excluded.assessment_length,
+                    content_hash=excluded.content_hash,
+                    crawled_at=CURRENT_TIMESTAMP
+                WHERE products.content_hash IS NOT excluded.content_hash
+            ''', [(
+                product_data['name'],
+                product_data['url'],
+                product_data['remote_testing'],
+                product_data['adaptive_irt'],
+                product_data['test_type'],
+                product_data.get('description'),
+                product_data.get('job_levels'),
+                product_data.get('languages'),
+                product_data.get('assessment_length'),
+                content_hash(product_data)
+            ) for product_data in products])
+            self.conn.execute('COMMIT')
         except Exception as e:
-            logger.error(f"Error saving {product_data['name']} to DB: {e}")
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            logger.error(f"Error saving {len(products)} products to DB: {e}")
 
-    def get_soup(self, url):
+    async def fetch(self, url):
         try:
-            for attempt in range(3):
+            for attempt in range(MAX_ATTEMPTS):
                 try:
-                    response = requests.get(url, headers=HEADERS, timeout=15)
-                    response.raise_for_status()
-                    return BeautifulSoup(response.text, 'html.parser')
-                except requests.exceptions.RequestException as e:
-                    if attempt == 2: raise
-                    logger.warning(f"Attempt {attempt + 1} failed for {url}: {e}. Retrying...")
-                    time.sleep(2)
+                    # Bound the number of in-flight requests across all tasks
+                    async with self.semaphore:
+                        if self.rate_limiter:
+                            await self.rate_limiter.acquire()
+                        async with self.session.get(url) as response:
+                            response.raise_for_status()
+                            body = await response.read()
+                            # Lexbor parses UTF-8 bytes directly, so skip the
+                            # str decode unless the page uses another charset
+                            charset = response.charset
+                            if charset and charset.lower() not in ('utf-8', 'utf8'):
+                                body = body.decode(charset, errors='replace').encode()
+                            return body
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    is_permanent = isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES
+                    if is_permanent or attempt == MAX_ATTEMPTS - 1: raise
+                    delay = RETRY_BACKOFF * 2 ** attempt
+                    logger.warning(f"Attempt {attempt + 1} failed for {url}: {e}. Retrying in {delay}s...")
+                    await asyncio.sleep(delay)
         except Exception as e:
             logger.error(f"Error fetching {url}: {e}")
             return None
 
-    def scrape_catalog(self, start=0):
+    async def get_tree(self, url):
+        body = await self.fetch(url)
+        if body is None:
+            return None
+        # Parse in a worker thread so the event loop keeps serving other fetches
+        return await asyncio.to_thread(LexborHTMLParser, body)
+
+    async def scrape_catalog(self, start=0):
         url = f"{CATALOG_BASE_URL}?start={start}&type=1"
         logger.info(f"Scraping catalog page (start={start}): {url}")
-        soup = self.get_soup(url)
-        if not soup:
+        tree = await self.get_tree(url)
+        if not tree:
             return []
 
-        tables = soup.find_all('div', class_='custom__table-responsive')
+        tables = tree.css('div.custom__table-responsive')
         individual_table_container = None
         
         # Search specifically for the "Individual Test Solutions" table
         for t in tables:
-            heading = t.find('th', class_='custom__table-heading__title')
-            if heading and "Individual Test Solutions" in heading.text:
+            heading = t.css_first('th.custom__table-heading__title')
+            if heading and "Individual Test Solutions" in heading.text():
                 individual_table_container = t
                 break
         
@@ -124,29 +219,29 @@ class SHLCrawler:
                 logger.warning(f"Could not find 'Individual Test Solutions' table on page with start={start}.")
                 return []
 
-        individual_table = individual_table_container.find('table')
+        individual_table = individual_table_container.css_first('table')
         if not individual_table:
             return []
 
-        rows = individual_table.find_all('tr')[1:] # Skip header row
+        rows = individual_table.css('tr')[1:] # Skip header row
         products = []
 
         for row in rows:
-            cols = row.find_all('td')
+            cols = row.css('td')
             if len(cols) < 4:
                 continue
 
-            name_link = cols[0].find('a')
+            name_link = cols[0].css_first('a')
             if not name_link:
                 continue
 
-            name = name_link.text.strip()
-            href = name_link.get('href')
+            name = name_link.text().strip()
+            href = name_link.attributes.get('href')
             full_url = href if href.startswith('http') else f"{BASE_URL}{href}"
 
-            remote_testing = bool(cols[1].find('span', class_='-yes'))
-            adaptive_irt = bool(cols[2].find('span', class_='-yes'))
-            test_types = [span.text.strip() for span in cols[3].find_all('span', class_='product-catalogue__key')]
+            remote_testing = cols[1].css_first('span.-yes') is not None
+            adaptive_irt = cols[2].css_first('span.-yes') is not None
+            test_types = [span.text().strip() for span in cols[3].css('span.product-catalogue__key')]
             
             products.append({
                 'name': name,
@@ -159,65 +254,92 @@ class SHLCrawler:
         logger.info(f"Found {len(products)} products on this page.")
         return products
 
-    def scrape_detail(self, product):
+    async def scrape_detail(self, product):
         logger.info(f"Scraping detail: {product['url']}")
-        soup = self.get_soup(product['url'])
-        if not soup:
-            return product
-
-        headings = soup.find_all('h4')
-        for h in headings:
-            label = h.text.strip().lower()
-            content_node = h.find_next_sibling()
-            content = content_node.text.strip() if content_node else ""
-
-            if "description" in label:
-                product['description'] = content
-            elif "job levels" in label:
-                product['job_levels'] = content
-            elif "languages" in label:
-                product['languages'] = content
-            elif "assessment length" in label:
-                match = re.search(r'(\d+)', content)
-                product['assessment_length'] = match.group(1) if match else None
-
-        # Save immediately after scraping detail effectively within the thread
-        self.save_product(product)
+        tree = await self.get_tree(product['url'])
+        if not tree:
+            return None
+
+        # Each label is filled by its first matching heading; stop once all are found
+        needed = dict(DETAIL_FIELDS)
+        for h in tree.css('h4'):
+            label = h.text().strip().lower()
+            key = next((k for k in needed if k in label), None)
+            if key is None:
+                continue
+            field = needed.pop(key)
+
+            content_node = next_element_sibling(h)
+            content = content_node.text().strip() if content_node else ""
+            if field == 'assessment_length':
+                match = DIGITS_RE.search(content)
+                product[field] = match.group() if match else None
+            else:
+                product[field] = content
+
+            if not needed:
+                break
+
         return product
 
-    def run(self):
-        start = 0
+    async def crawl(self):
         total_discovered = 0
         
-        # Parallel setup
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = []
+        # One pooled session for all requests, so connections are kept alive
+        connector = aiohttp.TCPConnector(limit=32, limit_per_host=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=15)
+        async with aiohttp.ClientSession(headers=HEADERS, connector=connector, timeout=timeout) as session:
+            self.session = session
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            if self.max_requests_per_second:
+                self.rate_limiter = RateLimiter(self.max_requests_per_second)
+            tasks = []
+            
+            # Fetch every catalog page at once; pages past the end of the
+            # catalog simply come back empty
+            pages = [
+                self.scrape_catalog(start)
+                for start in range(0, MAX_CATALOG_START + 1, CATALOG_PAGE_SIZE)
+            ]
             
-            while True:
-                products = self.scrape_catalog(start)
-                if not products:
-                    break
-                
-                for product in products:
-                    futures.append(executor.submit(self.scrape_detail, product))
+            # Queue detail scrapes as soon as each page arrives, so they run
+            # alongside the remaining catalog fetches
+            for page in asyncio.as_completed(pages):
+                for product in await page:
+                    tasks.append(asyncio.create_task(self.scrape_detail(product)))
                     total_discovered += 1
-                
-                start += 12
-                if start > 500: # Safety break
-                    break
             
             logger.info(f"All pages queued. Total products queued: {total_discovered}. Waiting for completion...")
             
-            # Monitoring progress
+            # Monitoring progress, saving finished products in batches
             completed = 0
-            for future in as_completed(futures):
+            pending = []
+            for task in asyncio.as_completed(tasks):
+                try:
+                    product = await task
+                    if product:
+                        pending.append(product)
+                except Exception as e:
+                    logger.error(f"Error scraping detail: {e}")
                 completed += 1
                 if completed % 10 == 0:
                     logger.info(f"Progress: {completed}/{total_discovered} completed.")
+                if len(pending) >= SAVE_BATCH_SIZE:
+                    self.save_products(pending)
+                    pending = []
+            
+            if pending:
+                self.save_products(pending)
 
         logger.info(f"Crawling completed. Total products processed: {total_discovered}")
 
+    def run(self):
+        try:
+            asyncio.run(self.crawl())
+        finally:
+            self.close()
+
 if __name__ == "__main__":
-    # You can adjust max_workers to be faster (e.g., 20) but 10 is safe and significantly faster
-    crawler = SHLCrawler(max_workers=10)
+    # Up to 16 requests in flight from a single thread; lower it to be gentler on the site
+    crawler = SHLCrawler(max_concurrency=16)
     crawler.run()
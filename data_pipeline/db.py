@@ -0,0 +1,17 @@
+import sqlite3
+
+# Applied to every new connection: WAL lets commits append to a log instead of
+# rewriting pages, and synchronous=NORMAL only fsyncs at checkpoints
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+)
+
+def connect_db(db_path, **kwargs):
+    """Opens a SQLite connection with SQLITE_PRAGMAS applied; kwargs go to sqlite3.connect."""
+    conn = sqlite3.connect(db_path, **kwargs)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
@@ -1,10 +1,11 @@
-import sqlite3
 import os
 import json
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from openai import AzureOpenAI
+import numpy as np
+from openai import AsyncAzureOpenAI
 from dotenv import load_dotenv
+from db import connect_db
 
 # Configure logging
 logging.basicConfig(
@@ -16,7 +17,7 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Initialize Azure OpenAI client
-client = AzureOpenAI(
+client = AsyncAzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
     api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15"),
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -24,75 +25,164 @@ client = AzureOpenAI(
 
 DB_PATH = "shl_products.db"
 
+# Embedding updates are committed in transactions of this size
+UPDATE_BATCH_SIZE = 50
+
+# Number of products embedded per Azure OpenAI request
+EMBEDDING_BATCH_SIZE = 64
+
+# Embeddings are stored as packed little-endian float32 BLOBs, the format the
+# backend loads directly (6 KB per 1536-d vector instead of ~30 KB of JSON)
+EMBEDDING_DTYPE = np.dtype("<f4")
+
 def add_embedding_column():
-    """Adds an 'embedding' column to the products table if it doesn't already exist."""
+    """Adds an 'embedding_f32' column to the products table if it doesn't already exist."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with connect_db(DB_PATH) as conn:
             cursor = conn.cursor()
             # Check if column exists
             cursor.execute("PRAGMA table_info(products)")
             columns = [column[1] for column in cursor.fetchall()]
-            if 'embedding' not in columns:
-                logger.info("Adding 'embedding' column to 'products' table...")
-                cursor.execute("ALTER TABLE products ADD COLUMN embedding TEXT")
+            if 'embedding_f32' not in columns:
+                logger.info("Adding 'embedding_f32' column to 'products' table...")
+                cursor.execute("ALTER TABLE products ADD COLUMN embedding_f32 BLOB")
                 conn.commit()
             else:
-                logger.info("'embedding' column already exists.")
+                logger.info("'embedding_f32' column already exists.")
+            
+            # Partial index over rows still missing an embedding, so re-runs
+            # only visit the remaining rows instead of scanning the table
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_products_missing_embedding
+                ON products(id) WHERE embedding_f32 IS NULL
+            """)
+            conn.commit()
+            
+            if 'embedding' in columns:
+                convert_json_embeddings(conn)
     except Exception as e:
         logger.error(f"Error adding column: {e}")
 
-def get_embedding(text, deployment_name=None):
-    """Generates an embedding for the given text using Azure OpenAI."""
+def convert_json_embeddings(conn):
+    """Converts embeddings from the legacy JSON 'embedding' column so they aren't regenerated."""
+    rows = conn.execute("""
+        SELECT id, embedding
+        FROM products
+        WHERE embedding_f32 IS NULL AND embedding IS NOT NULL AND embedding != ''
+    """).fetchall()
+    if not rows:
+        return
+    
+    # Parse rows individually so one corrupt value doesn't abort the conversion
+    updates = []
+    for row_id, embedding_str in rows:
+        try:
+            embedding = np.asarray(json.loads(embedding_str), dtype=EMBEDDING_DTYPE)
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            logger.warning(f"Skipping product {row_id}: failed to parse embedding: {e}")
+            continue
+        if embedding.ndim != 1 or embedding.size == 0:
+            logger.warning(f"Skipping product {row_id}: invalid embedding")
+            continue
+        updates.append((embedding.tobytes(), row_id))
+    
+    conn.executemany("UPDATE products SET embedding_f32 = ? WHERE id = ?", updates)
+    conn.commit()
+    logger.info(f"Converted {len(updates)} of {len(rows)} JSON embeddings to float32 BLOBs")
+
+def to_blob(embedding):
+    """Packs an embedding vector into a float32 BLOB."""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+async def get_embeddings(texts, deployment_name=None):
+    """Generates embeddings for a batch of texts in a single Azure OpenAI request."""
     try:
         # Get deployment name from env if not provided
         deployment_name = deployment_name or os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
         
         if not deployment_name:
             logger.error("AZURE_OPENAI_EMBEDDING_DEPLOYMENT not found.")
-            return None
+            return [None] * len(texts)
 
-        # Standardize text
-        text = text.replace("\n", " ").strip()
-        if not text:
-            return None
-            
-        response = client.embeddings.create(
-            input=[text], 
+        response = await client.embeddings.create(
+            input=texts, 
             model=deployment_name
         )
-        return response.data[0].embedding
+        # Results carry the index of their input; don't rely on response order
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
     except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
-        return None
+        logger.error(f"Error generating embeddings for batch of {len(texts)}: {e}")
+        return [None] * len(texts)
 
-def process_single_row(row_id, name, description, job_levels):
-    """Worker function to process a single row's embedding."""
-    logger.info(f"Generating embedding for: {name}")
+def build_content(name, description, job_levels):
+    """Combines the relevant product fields into the text to embed."""
+    fields = (("Product Name", name), ("Description", description), ("Target Job Levels", job_levels))
     
-    # Combine relevant fields for embedding context
-    parts = []
-    if name: parts.append(f"Product Name: {name}")
-    if description: parts.append(f"Description: {description}")
-    if job_levels: parts.append(f"Target Job Levels: {job_levels}")
+    # Standardize text onto a single line
+    return " ".join(f"{label}: {value}" for label, value in fields if value).replace("\n", " ").strip()
+
+async def process_batch(rows, semaphore):
+    """Embeds a batch of rows with one API request."""
+    logger.info(f"Generating embeddings for {len(rows)} products")
     
-    content = "\n".join(parts)
+    contents = [build_content(name, desc, job) for _, name, desc, job in rows]
     
-    if not content:
-        return row_id, None, name
+    # Empty inputs are rejected by the API, so only send rows with content
+    to_embed = [i for i, content in enumerate(contents) if content]
+    embeddings = [None] * len(rows)
+    if to_embed:
+        # Bound the number of requests in flight to stay within the deployment's rate limits
+        async with semaphore:
+            batch_embeddings = await get_embeddings([contents[i] for i in to_embed])
+        for i, embedding in zip(to_embed, batch_embeddings):
+            embeddings[i] = embedding
     
-    embedding = get_embedding(content)
-    return row_id, embedding, name
+    return [(row[0], embedding, row[1]) for row, embedding in zip(rows, embeddings)]
 
-def process_embeddings(max_workers=10):
-    """Fetches products without embeddings and populates them in parallel."""
+def save_embeddings(conn, updates):
+    """Writes a batch of (embedding, row_id) updates in a single transaction."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        conn.executemany("UPDATE products SET embedding_f32 = ? WHERE id = ?", updates)
+        conn.commit()
+        logger.info(f"Successfully updated {len(updates)} embeddings")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error updating DB for {len(updates)} embeddings: {e}")
+
+async def embed_rows(conn, rows, max_concurrency):
+    """Embeds rows in concurrent batch requests, saving results as batches complete."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = [
+        process_batch(rows[i:i + EMBEDDING_BATCH_SIZE], semaphore)
+        for i in range(0, len(rows), EMBEDDING_BATCH_SIZE)
+    ]
+    
+    # Process results as they complete
+    updates = []
+    for task in asyncio.as_completed(tasks):
+        for row_id, embedding, name in await task:
+            if embedding:
+                updates.append((to_blob(embedding), row_id))
+            else:
+                logger.warning(f"Failed to get embedding for: {name}")
+        
+        if len(updates) >= UPDATE_BATCH_SIZE:
+            save_embeddings(conn, updates)
+            updates = []
+    
+    if updates:
+        save_embeddings(conn, updates)
+
+def process_embeddings(max_concurrency=4):
+    """Fetches products without embeddings and populates them in batched requests."""
+    try:
+        with connect_db(DB_PATH) as conn:
             cursor = conn.cursor()
             # Fetch products that need embeddings
             cursor.execute("""
                 SELECT id, name, description, job_levels 
                 FROM products 
-                WHERE embedding IS NULL
+                WHERE embedding_f32 IS NULL
             """)
             rows = cursor.fetchall()
             
@@ -100,36 +190,8 @@ def process_embeddings(max_workers=10):
                 logger.info("No products without embeddings found.")
                 return
 
-            logger.info(f"Processing embeddings for {len(rows)} products using {max_workers} workers...")
-            
-            # Use ThreadPoolExecutor for parallel API calls
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # Submit all tasks
-                future_to_row = {
-                    executor.submit(process_single_row, rid, name, desc, job): (rid, name) 
-                    for rid, name, desc, job in rows
-                }
-                
-                # Process results as they complete
-                for future in as_completed(future_to_row):
-                    row_id, embedding, name = future.result()
-                    
-                    if embedding:
-                        # Store result (updates are sequential to avoid DB locking issues)
-                        try:
-                            embedding_json = json.dumps(embedding)
-                            cursor.execute(
-                                "UPDATE products SET embedding = ? WHERE id = ?", 
-                                (embedding_json, row_id)
-                            )
-                            # We commit periodically or at the end. 
-                            # For safety with parallel submissions finishing, we commit here.
-                            conn.commit()
-                            logger.info(f"Successfully updated embedding for: {name}")
-                        except Exception as e:
-                            logger.error(f"Error updating DB for {name}: {e}")
-                    else:
-                        logger.warning(f"Failed to get embedding for: {name}")
+            logger.info(f"Processing embeddings for {len(rows)} products with up to {max_concurrency} concurrent requests...")
+            asyncio.run(embed_rows(conn, rows, max_concurrency))
 
     except Exception as e:
         logger.error(f"Error in process_embeddings: {e}")